@@ -2,12 +2,29 @@ from __future__ import annotations
 
 import json
 import os
+import queue
 import sqlite3
-from datetime import datetime, date
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from datetime import date
 from functools import wraps
-from typing import Any, Dict, Optional
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Protocol, Tuple, TypeVar
 
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+import msgpack
+from flask import Flask, render_template, request, redirect, url_for, flash, session, g
+
+try:
+    import orjson
+
+    def json_dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode()
+
+    json_loads = orjson.loads
+except ImportError:  # orjson is optional; the stdlib gives the same results, just slower
+    json_dumps = json.dumps
+    json_loads = json.loads
 
 APP_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(APP_DIR, "todo.db")
@@ -24,81 +41,493 @@ APP_PASSWORD = os.environ.get("TODO_APP_PASSWORD", "1234")
 # -------------------------
 # Auth helper
 # -------------------------
+@app.before_request
+def load_auth() -> None:
+    # Read the session once per request; routes check g.authed from here on
+    g.authed = bool(session.get("authed"))
+
+
 def login_required(fn):
     @wraps(fn)
     def wrapper(*args, **kwargs):
-        if not session.get("authed"):
+        if not g.authed:
             return redirect(url_for("login"))
         return fn(*args, **kwargs)
     return wrapper
 
 
+# -------------------------
+# SQL
+# -------------------------
+# Kept as module constants so every call reuses the same statement text.
+SQL_INSERT_TASK = (
+    "INSERT INTO tasks (title, due_date, done, deleted, created_at, updated_at) "
+    "VALUES (?, ?, 0, 0, ?, ?) RETURNING id"
+)
+# New events keep their payload as MessagePack in payload_blob; payload_json is
+# only filled on rows written before that column existed.
+SQL_INSERT_EVENT = (
+    "INSERT INTO events (action, task_id, payload_json, payload_blob, created_at) VALUES (?, ?, '', ?, ?)"
+)
+SQL_SELECT_TASK = "SELECT * FROM tasks WHERE id = ?"
+SQL_SET_DONE = "UPDATE tasks SET done=?, updated_at=? WHERE id=?"
+# Ids arrive as one JSON array so the statement text is the same for any count
+SQL_SELECT_TOGGLEABLE = "SELECT id, done FROM tasks WHERE deleted=0 AND id IN (SELECT value FROM json_each(?))"
+SQL_SET_TITLE_DUE = "UPDATE tasks SET title=?, due_date=?, updated_at=? WHERE id=?"
+SQL_SET_DELETED = "UPDATE tasks SET deleted=?, updated_at=? WHERE id=?"
+SQL_DELETE_TASK = "DELETE FROM tasks WHERE id=?"
+SQL_LATEST_EVENT = "SELECT * FROM events ORDER BY id DESC LIMIT 1"
+SQL_DELETE_EVENT = "DELETE FROM events WHERE id=?"
+SQL_RECENT_EVENTS = "SELECT * FROM events ORDER BY id DESC LIMIT 200"
+
+# Task list query. The latest event id (for the Undo button) rides along as an
+# uncorrelated scalar subquery, so the page needs one statement, not two;
+# :today drives the due-date badge.
+_TASK_LIST_SELECT = """
+    SELECT (SELECT MAX(id) FROM events) AS last_event_id,
+      id, title, due_date, done, deleted, updated_at,
+      CASE WHEN deleted=0 AND done=0 AND due_date IS NOT NULL AND due_date<>'' THEN
+        CASE WHEN due_date < :today THEN 'overdue'
+             WHEN due_date = :today THEN 'today'
+             ELSE 'scheduled' END
+      END AS badge_kind
+    FROM tasks
+"""
+_TASK_LIST_WHERE = {
+    "active": "WHERE deleted=0 AND done=0",
+    "all": "WHERE deleted=0",
+    "completed": "WHERE deleted=0 AND done=1",
+    "deleted": "WHERE deleted=1",
+}
+_TASK_LIST_ORDER = {
+    # id breaks ties between tasks updated in the same millisecond, keeping pages stable
+    "recent": "ORDER BY updated_at DESC, id DESC",
+    # due date first; nulls last; then updated_at. The terms match ix_tasks_due
+    # exactly (nulls-last expression included, id ASC as the implicit last
+    # column) so active/completed read in index order with no sort step.
+    "due": """
+    ORDER BY
+      (due_date IS NULL OR due_date=''),
+      due_date ASC,
+      updated_at DESC,
+      id ASC
+    """,
+}
+# (show, sort) -> full statement, built once so each request reuses the same text
+SQL_TASK_LIST = {
+    (show, sort): f"{_TASK_LIST_SELECT} {where} {order} LIMIT :limit OFFSET :offset"
+    for show, where in _TASK_LIST_WHERE.items()
+    for sort, order in _TASK_LIST_ORDER.items()
+}
+SQL_LAST_EVENT_ID = "SELECT MAX(id) FROM events"
+
+# Largest value an SQLite INTEGER column can hold
+SQLITE_MAX_INT = 2**63 - 1
+
+# Tasks shown per page on the index
+PAGE_SIZE = 50
+# Upper bound for ?page=; keeps the OFFSET well inside SQLite's 64-bit INTEGER
+MAX_PAGE = 1_000_000
+
+# badge_kind -> (label, bootstrap color)
+BADGES = {
+    "overdue": ("Overdue", "danger"),
+    "today": ("Due today", "warning"),
+    "scheduled": ("Scheduled", "secondary"),
+}
+
+
 # -------------------------
 # DB helpers
 # -------------------------
-def get_db() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+# Connections are reused across requests instead of opened per request.
+# Requests check one out on first use and hand it back on teardown. All writes
+# go through the writer thread, so pooled connections are opened read-only.
+POOL_SIZE = 4
+# Per-connection prepared-statement cache; long-lived connections keep it warm
+STATEMENT_CACHE_SIZE = 256
+_pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=POOL_SIZE)
+
+
+def _connect(readonly: bool = False) -> sqlite3.Connection:
+    target = Path(DB_PATH).as_uri() + ("?mode=ro" if readonly else "")
+    conn = sqlite3.connect(target, uri=True, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA foreign_keys = ON;")
+    # journal_mode=WAL is persistent and set once in init_db(); these are per-connection.
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    conn.execute("PRAGMA temp_store = MEMORY;")
+    conn.execute("PRAGMA cache_size = -20000;")
+    conn.execute("PRAGMA mmap_size = 134217728;")
     return conn
 
 
-def now_iso() -> str:
-    return datetime.utcnow().isoformat(timespec="seconds") + "Z"
+def get_db() -> sqlite3.Connection:
+    if "db" not in g:
+        try:
+            g.db = _pool.get_nowait()
+        except queue.Empty:
+            g.db = _connect(readonly=True)
+        if app.debug:
+            g.query_count = 0
+            g.db.set_trace_callback(_count_query)
+    return g.db
+
+
+@app.teardown_appcontext
+def release_db(exc: Optional[BaseException]) -> None:
+    conn = g.pop("db", None)
+    if conn is None:
+        return
+    conn.set_trace_callback(None)
+    if conn.in_transaction:
+        conn.rollback()
+    try:
+        _pool.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+
+def now_ms() -> int:
+    """Current UTC time as integer epoch milliseconds (how timestamps are stored)."""
+    return time.time_ns() // 1_000_000
+
+
+@app.before_request
+def stamp_request() -> None:
+    # One timestamp per request, shared by the task update and its event
+    g.now_ms = now_ms()
+
+
+@app.template_filter("ts")
+def format_ts(ms: int) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ms / 1000))
+
+
+# Bump when init_db() gains a migration step
+SCHEMA_VERSION = 3
+
+# {name} lets the timestamp migration build a replacement table with the same shape
+TASKS_DDL = """
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        due_date TEXT,
+        done INTEGER NOT NULL DEFAULT 0,
+        deleted INTEGER NOT NULL DEFAULT 0,
+        created_at INTEGER NOT NULL,
+        updated_at INTEGER NOT NULL
+    );
+"""
+EVENTS_DDL = """
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        action TEXT NOT NULL,
+        task_id INTEGER,
+        payload_json TEXT NOT NULL,
+        payload_blob BLOB,
+        created_at INTEGER NOT NULL
+    );
+"""
+
+
+def _iso_to_ms(col: str) -> str:
+    return f"CAST(strftime('%s', {col}) AS INTEGER) * 1000"
+
+
+def _migrate_timestamps_to_ms(db: sqlite3.Connection) -> None:
+    """
+    Rebuild tasks/events with INTEGER epoch-ms timestamps (SQLite can't change a
+    column's type in place). The AUTOINCREMENT counters are carried over so ids
+    freed by undo are never handed out again.
+    """
+    db.executescript(
+        f"""
+        BEGIN;
+        {TASKS_DDL.format(name="tasks_new")}
+        INSERT INTO tasks_new (id, title, due_date, done, deleted, created_at, updated_at)
+          SELECT id, title, due_date, done, deleted, {_iso_to_ms("created_at")}, {_iso_to_ms("updated_at")}
+          FROM tasks;
+        DELETE FROM sqlite_sequence WHERE name='tasks_new';
+        INSERT INTO sqlite_sequence (name, seq) SELECT 'tasks_new', seq FROM sqlite_sequence WHERE name='tasks';
+        DROP TABLE tasks;
+        ALTER TABLE tasks_new RENAME TO tasks;
+
+        {EVENTS_DDL.format(name="events_new")}
+        INSERT INTO events_new (id, action, task_id, payload_json, payload_blob, created_at)
+          SELECT id, action, task_id, payload_json, payload_blob, {_iso_to_ms("created_at")}
+          FROM events;
+        DELETE FROM sqlite_sequence WHERE name='events_new';
+        INSERT INTO sqlite_sequence (name, seq) SELECT 'events_new', seq FROM sqlite_sequence WHERE name='events';
+        DROP TABLE events;
+        ALTER TABLE events_new RENAME TO events;
+        COMMIT;
+        """
+    )
 
 
 def init_db() -> None:
-    with get_db() as db:
-        db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS tasks (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                due_date TEXT,
-                done INTEGER NOT NULL DEFAULT 0,
-                deleted INTEGER NOT NULL DEFAULT 0,
-                created_at TEXT NOT NULL,
-                updated_at TEXT NOT NULL
-            );
-            """
-        )
-        db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS events (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                action TEXT NOT NULL,
-                task_id INTEGER,
-                payload_json TEXT NOT NULL,
-                created_at TEXT NOT NULL
-            );
-            """
-        )
-        # Safety migration: if someone ran the older version without due_date
-        cols = [r["name"] for r in db.execute("PRAGMA table_info(tasks);").fetchall()]
-        if "due_date" not in cols:
-            db.execute("ALTER TABLE tasks ADD COLUMN due_date TEXT;")
+    conn = _connect()
+    with conn as db:
+        # WAL lets readers run alongside a writer and turns commits into appends
+        db.execute("PRAGMA journal_mode = WAL;")
+        db.execute(TASKS_DDL.format(name="tasks"))
+        db.execute(EVENTS_DDL.format(name="events"))
+        # Migrations run once per database; PRAGMA user_version records how far it got
+        version = db.execute("PRAGMA user_version;").fetchone()[0]
+        if version < 1:
+            # Safety migration: if someone ran the older version without due_date
+            cols = [r["name"] for r in db.execute("PRAGMA table_info(tasks);").fetchall()]
+            if "due_date" not in cols:
+                db.execute("ALTER TABLE tasks ADD COLUMN due_date TEXT;")
+            # Older events only have payload_json; those rows keep being read from there
+            cols = [r["name"] for r in db.execute("PRAGMA table_info(events);").fetchall()]
+            if "payload_blob" not in cols:
+                db.execute("ALTER TABLE events ADD COLUMN payload_blob BLOB;")
+        if version < 2:
+            # ISO-8601 TEXT timestamps -> INTEGER epoch ms (fresh tables are already INTEGER)
+            types = {r["name"]: r["type"] for r in db.execute("PRAGMA table_info(tasks);").fetchall()}
+            if types["created_at"] == "TEXT":
+                _migrate_timestamps_to_ms(db)
+        if version < 3:
+            # ix_tasks_due gained the nulls-last expression; rebuilt below
+            db.execute("DROP INDEX IF EXISTS ix_tasks_due;")
+
+        if version < SCHEMA_VERSION:
+            # Indexes for the list filters + sorts used by index(). ix_tasks_active is
+            # ascending on purpose: read backwards it yields updated_at DESC, id DESC.
+            db.execute("CREATE INDEX IF NOT EXISTS ix_tasks_active ON tasks (deleted, done, updated_at);")
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS ix_tasks_due ON tasks "
+                "(deleted, done, (due_date IS NULL OR due_date=''), due_date, updated_at DESC);"
+            )
+            db.execute("ANALYZE;")
+            db.execute(f"PRAGMA user_version = {SCHEMA_VERSION};")
+    conn.close()
+
+
+class WriteConn(Protocol):
+    """
+    The connection surface write ops and the helpers they call may rely on. On
+    the writer thread ops get a _CountingConnection, which only forwards these;
+    a plain sqlite3.Connection satisfies it too.
+    """
+
+    def execute(self, sql: str, params: Any = ...) -> sqlite3.Cursor: ...
 
+    def executemany(self, sql: str, seq_of_params: Any) -> sqlite3.Cursor: ...
 
-def log_event(db: sqlite3.Connection, action: str, task_id: Optional[int], payload: Dict[str, Any]) -> None:
-    db.execute(
-        "INSERT INTO events (action, task_id, payload_json, created_at) VALUES (?, ?, ?, ?)",
-        (action, task_id, json.dumps(payload), now_iso()),
+
+def encode_payload(payload: Dict[str, Any]) -> bytes:
+    return msgpack.packb(payload, use_bin_type=True)
+
+
+def decode_payload(ev: sqlite3.Row) -> Dict[str, Any]:
+    if ev["payload_blob"] is not None:
+        return msgpack.unpackb(ev["payload_blob"], raw=False)
+    return json_loads(ev["payload_json"])
+
+
+def log_event(
+    db: WriteConn, action: str, task_id: Optional[int], payload: Dict[str, Any], created_at: int
+) -> None:
+    db.execute(SQL_INSERT_EVENT, (action, task_id, encode_payload(payload), created_at))
+
+
+def log_events(
+    db: WriteConn, action: str, items: List[Tuple[int, Dict[str, Any]]], created_at: int
+) -> None:
+    """Batch form of log_event: one executemany for a list of (task_id, payload)."""
+    db.executemany(
+        SQL_INSERT_EVENT,
+        [(action, task_id, encode_payload(payload), created_at) for task_id, payload in items],
     )
 
 
-def fetch_task(db: sqlite3.Connection, task_id: int) -> sqlite3.Row:
-    row = db.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
+def clamp_page(page: int) -> int:
+    return min(max(page, 1), MAX_PAGE)
+
+
+def fetch_task(db: WriteConn, task_id: int) -> sqlite3.Row:
+    row = db.execute(SQL_SELECT_TASK, (task_id,)).fetchone()
     if row is None:
         raise ValueError("Task not found")
     return row
 
 
+@app.template_filter("payload")
+def payload_filter(ev: sqlite3.Row) -> str:
+    return json_dumps(decode_payload(ev))
+
+
+# -------------------------
+# Query budgets (debug only)
+# -------------------------
+# Max statements an endpoint may run: reads on its request connection plus the
+# statements its write op ran on the writer connection. An executemany() counts
+# once, so a batched write stays flat no matter how many rows it touches.
+QUERY_BUDGETS = {
+    "index": 2,  # task list, plus the MAX(id) lookup when the page is empty
+    "edit_page": 1,
+    "activity": 2,  # MAX(id) cache check, plus the feed itself on a miss
+    "add_task": 2,  # task INSERT ... RETURNING + event INSERT
+    "toggle_task": 3,  # task SELECT + UPDATE + event INSERT
+    "bulk_toggle": 3,  # one SELECT + one executemany each for UPDATEs and events
+    "edit_task": 3,
+    "delete_task": 3,
+    "restore_task": 3,
+    "undo_last": 3,  # event SELECT + revert + event DELETE
+}
+
+
+def _count_query(sql: str) -> None:
+    g.query_count += 1
+
+
+@app.after_request
+def check_query_budget(response):
+    budget = QUERY_BUDGETS.get(request.endpoint)
+    count = g.get("query_count", 0)
+    if budget is not None and count > budget:
+        app.logger.warning("%s ran %d queries (budget %d)", request.endpoint, count, budget)
+    return response
+
+
+# -------------------------
+# Background writer
+# -------------------------
+# Every write runs on one thread that owns the write connection. Ops that queue
+# up together share a single BEGIN IMMEDIATE ... COMMIT (one fsync for the
+# batch); each op gets its own SAVEPOINT so a failing op doesn't roll back the
+# others. Futures resolve only after COMMIT, so a route that waits on its op
+# can redirect straight to a page that reads the new state.
+WRITE_QUEUE_SIZE = 256
+WRITE_BATCH_MAX = 64
+# How long a request waits to queue its op, and for the writer to pick it up,
+# before giving up with an error (a 500). Only ops that never started fail this
+# way; once an op is running the request waits for its real outcome.
+WRITE_TIMEOUT = 10.0
+
+T = TypeVar("T")
+WriteOp = Callable[[WriteConn], Any]
+
+_write_queue: "queue.Queue[Tuple[WriteOp, Future]]" = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+_writer_lock = threading.Lock()
+_writer: Optional[threading.Thread] = None
+
+
+class _CountingConnection:
+    """WriteConn over the writer connection that counts execute/executemany calls."""
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self._conn = conn
+        self.statements = 0
+
+    def execute(self, sql: str, params: Any = ()) -> sqlite3.Cursor:
+        self.statements += 1
+        return self._conn.execute(sql, params)
+
+    def executemany(self, sql: str, seq_of_params: Any) -> sqlite3.Cursor:
+        self.statements += 1
+        return self._conn.executemany(sql, seq_of_params)
+
+
+def _apply_batch(
+    conn: sqlite3.Connection, batch: List[Tuple[WriteOp, Future]]
+) -> List[Tuple[Future, Any, Optional[BaseException]]]:
+    outcomes: List[Tuple[Future, Any, Optional[BaseException]]] = []
+    conn.execute("BEGIN IMMEDIATE")
+    for op, fut in batch:
+        # Skip ops whose request already gave up waiting
+        if not fut.set_running_or_notify_cancel():
+            continue
+        conn.execute("SAVEPOINT op")
+        counted = _CountingConnection(conn)
+        try:
+            # Futures resolve to (op result, statements the op ran)
+            outcomes.append((fut, (op(counted), counted.statements), None))
+        except Exception as e:
+            conn.execute("ROLLBACK TO op")
+            outcomes.append((fut, None, e))
+        conn.execute("RELEASE op")
+    conn.execute("COMMIT")
+    return outcomes
+
+
+def _writer_loop() -> None:
+    conn: Optional[sqlite3.Connection] = None
+    while True:
+        batch = [_write_queue.get()]
+        while len(batch) < WRITE_BATCH_MAX:
+            try:
+                batch.append(_write_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        try:
+            if conn is None:
+                conn = _connect()
+                conn.isolation_level = None  # transactions are managed explicitly
+            outcomes = _apply_batch(conn, batch)
+        except BaseException as e:  # the loop itself must never exit
+            # Connect/BEGIN/COMMIT failed: the connection is in an unknown state, so
+            # drop it (closing rolls back) and reconnect on the next batch
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                conn = None
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            continue
+
+        for fut, result, err in outcomes:
+            if err is None:
+                fut.set_result(result)
+            else:
+                fut.set_exception(err)
+
+
+def submit_write(op: WriteOp) -> Future:
+    """
+    Queue op(conn) for the writer thread; raises queue.Full if it stays full past
+    WRITE_TIMEOUT. The future resolves to (op result, statements the op ran).
+    """
+    global _writer
+    if _writer is None or not _writer.is_alive():
+        with _writer_lock:
+            if _writer is None or not _writer.is_alive():
+                _writer = threading.Thread(target=_writer_loop, name="db-writer", daemon=True)
+                _writer.start()
+    fut: Future = Future()
+    _write_queue.put((op, fut), timeout=WRITE_TIMEOUT)
+    return fut
+
+
+def run_write(op: Callable[[WriteConn], T]) -> T:
+    """Run op on the writer thread and wait until its batch has committed."""
+    fut = submit_write(op)
+    try:
+        result, statements = fut.result(timeout=WRITE_TIMEOUT)
+    except FutureTimeoutError:
+        # Still queued: cancelling guarantees it never runs, so the error is safe to retry
+        if fut.cancel():
+            raise
+        # Already running: its batch will commit or fail, so wait for the real outcome
+        result, statements = fut.result()
+    if app.debug:
+        g.query_count = g.get("query_count", 0) + statements
+    return result
+
+
 # -------------------------
 # Auth routes
 # -------------------------
 @app.get("/login")
 def login():
-    if session.get("authed"):
+    if g.authed:
         return redirect(url_for("index"))
     return render_template("login.html")
 
@@ -127,50 +556,37 @@ def logout():
 def index():
     show = request.args.get("show", "active")  # active | all | completed | deleted
     sort = request.args.get("sort", "recent")  # recent | due
+    page = clamp_page(request.args.get("page", 1, type=int))
 
     today = date.today().isoformat()
+    # Unknown filter/sort values fall back to active/recent
+    query_key = (
+        show if show in _TASK_LIST_WHERE else "active",
+        sort if sort in _TASK_LIST_ORDER else "recent",
+    )
 
     with get_db() as db:
-        where = ""
-        if show == "all":
-            where = "WHERE deleted=0"
-        elif show == "completed":
-            where = "WHERE deleted=0 AND done=1"
-        elif show == "deleted":
-            where = "WHERE deleted=1"
-        else:
-            where = "WHERE deleted=0 AND done=0"
-
-        if sort == "due":
-            # due date first; nulls last; then updated_at
-            order = """
-            ORDER BY
-              CASE WHEN due_date IS NULL OR due_date='' THEN 1 ELSE 0 END,
-              due_date ASC,
-              updated_at DESC
-            """
+        # One extra row tells us whether there is a next page
+        params = {"today": today, "limit": PAGE_SIZE + 1, "offset": (page - 1) * PAGE_SIZE}
+        tasks = db.execute(SQL_TASK_LIST[query_key], params).fetchall()
+        has_next = len(tasks) > PAGE_SIZE
+        tasks = tasks[:PAGE_SIZE]
+        if tasks:
+            last_event_id = tasks[0]["last_event_id"]
         else:
-            order = "ORDER BY updated_at DESC"
-
-        tasks_rows = db.execute(f"SELECT * FROM tasks {where} {order}").fetchall()
-        last_event = db.execute("SELECT id, action, created_at FROM events ORDER BY id DESC LIMIT 1").fetchone()
-
-    # Decorate tasks with badges
-    tasks = []
-    for r in tasks_rows:
-        t = dict(r)
-        badge = None
-        if t["deleted"] == 0 and t["done"] == 0 and t.get("due_date"):
-            if t["due_date"] < today:
-                badge = ("Overdue", "danger")
-            elif t["due_date"] == today:
-                badge = ("Due today", "warning")
-            else:
-                badge = ("Scheduled", "secondary")
-        t["badge"] = badge
-        tasks.append(t)
-
-    return render_template("index.html", tasks=tasks, show=show, sort=sort, last_event=last_event)
+            # Empty view: the subquery had no row to ride on
+            last_event_id = db.execute(SQL_LAST_EVENT_ID).fetchone()[0]
+
+    return render_template(
+        "index.html",
+        tasks=tasks,
+        badges=BADGES,
+        show=show,
+        sort=sort,
+        page=page,
+        has_next=has_next,
+        last_event_id=last_event_id,
+    )
 
 
 @app.post("/add")
@@ -183,36 +599,69 @@ def add_task():
         flash("Task title can’t be empty.", "error")
         return redirect(url_for("index"))
 
-    with get_db() as db:
-        ts = now_iso()
-        cur = db.execute(
-            "INSERT INTO tasks (title, due_date, done, deleted, created_at, updated_at) VALUES (?, ?, 0, 0, ?, ?)",
-            (title, due_date, ts, ts),
-        )
-        task_id = cur.lastrowid
-        log_event(db, "create", task_id, {"title": title, "due_date": due_date})
+    ts = g.now_ms
+
+    def op(db: WriteConn) -> None:
+        task_id = db.execute(SQL_INSERT_TASK, (title, due_date, ts, ts)).fetchone()[0]
+        log_event(db, "create", task_id, {"title": title, "due_date": due_date}, ts)
 
+    run_write(op)
     return redirect(url_for("index"))
 
 
 @app.post("/toggle/<int:task_id>")
 @login_required
 def toggle_task(task_id: int):
-    with get_db() as db:
+    ts = g.now_ms
+
+    def op(db: WriteConn) -> bool:
         task = fetch_task(db, task_id)
         if task["deleted"] == 1:
-            flash("Can’t toggle a deleted task.", "error")
-            return redirect(url_for("index", show="deleted"))
+            return False
 
         before_done = int(task["done"])
         after_done = 0 if before_done == 1 else 1
-        ts = now_iso()
-        db.execute("UPDATE tasks SET done=?, updated_at=? WHERE id=?", (after_done, ts, task_id))
-        log_event(db, "toggle", task_id, {"before_done": before_done, "after_done": after_done})
+        db.execute(SQL_SET_DONE, (after_done, ts, task_id))
+        log_event(db, "toggle", task_id, {"before_done": before_done, "after_done": after_done}, ts)
+        return True
+
+    if not run_write(op):
+        flash("Can’t toggle a deleted task.", "error")
+        return redirect(url_for("index", show="deleted"))
 
     return redirect(url_for("index"))
 
 
+@app.post("/bulk/toggle")
+@login_required
+def bulk_toggle():
+    # Ids outside SQLite's INTEGER range can't match a row (and won't serialize)
+    task_ids = sorted({i for i in request.form.getlist("task_ids", type=int) if 0 < i <= SQLITE_MAX_INT})
+    if not task_ids:
+        flash("Select at least one task.", "info")
+        return redirect(url_for("index"))
+
+    ts = g.now_ms
+
+    def op(db: WriteConn) -> None:
+        tasks = db.execute(SQL_SELECT_TOGGLEABLE, (json_dumps(task_ids),)).fetchall()
+        # Deleted / missing ids are skipped; each toggled task still gets its own event
+        changes = [(t["id"], int(t["done"]), 1 - int(t["done"])) for t in tasks]
+        db.executemany(SQL_SET_DONE, [(after, ts, task_id) for task_id, _, after in changes])
+        log_events(
+            db,
+            "toggle",
+            [(task_id, {"before_done": before, "after_done": after}) for task_id, before, after in changes],
+            ts,
+        )
+
+    run_write(op)
+    show = request.form.get("show", "active")
+    sort = request.form.get("sort", "recent")
+    page = clamp_page(request.form.get("page", 1, type=int))
+    return redirect(url_for("index", show=show, sort=sort, page=page))
+
+
 @app.get("/edit/<int:task_id>")
 @login_required
 def edit_page(task_id: int):
@@ -231,42 +680,48 @@ def edit_task(task_id: int):
         flash("Task title can’t be empty.", "error")
         return redirect(url_for("edit_page", task_id=task_id))
 
-    with get_db() as db:
+    ts = g.now_ms
+
+    def op(db: WriteConn) -> None:
         task = fetch_task(db, task_id)
         old_title = task["title"]
         old_due = task["due_date"]
 
-        ts = now_iso()
-        db.execute(
-            "UPDATE tasks SET title=?, due_date=?, updated_at=? WHERE id=?",
-            (new_title, new_due, ts, task_id),
-        )
+        db.execute(SQL_SET_TITLE_DUE, (new_title, new_due, ts, task_id))
         log_event(
             db,
             "edit",
             task_id,
             {"before_title": old_title, "after_title": new_title, "before_due": old_due, "after_due": new_due},
+            ts,
         )
 
+    run_write(op)
     return redirect(url_for("index"))
 
 
 @app.post("/delete/<int:task_id>")
 @login_required
 def delete_task(task_id: int):
-    with get_db() as db:
+    ts = g.now_ms
+
+    def op(db: WriteConn) -> bool:
         task = fetch_task(db, task_id)
         if task["deleted"] == 1:
-            return redirect(url_for("index", show="deleted"))
+            return False
 
-        ts = now_iso()
-        db.execute("UPDATE tasks SET deleted=1, updated_at=? WHERE id=?", (ts, task_id))
+        db.execute(SQL_SET_DELETED, (1, ts, task_id))
         log_event(
             db,
             "delete",
             task_id,
             {"title": task["title"], "was_done": int(task["done"]), "due_date": task["due_date"]},
+            ts,
         )
+        return True
+
+    if not run_write(op):
+        return redirect(url_for("index", show="deleted"))
 
     return redirect(url_for("index"))
 
@@ -274,14 +729,19 @@ def delete_task(task_id: int):
 @app.post("/restore/<int:task_id>")
 @login_required
 def restore_task(task_id: int):
-    with get_db() as db:
+    ts = g.now_ms
+
+    def op(db: WriteConn) -> bool:
         task = fetch_task(db, task_id)
         if task["deleted"] == 0:
-            return redirect(url_for("index"))
+            return False
 
-        ts = now_iso()
-        db.execute("UPDATE tasks SET deleted=0, updated_at=? WHERE id=?", (ts, task_id))
-        log_event(db, "restore", task_id, {"title": task["title"], "due_date": task["due_date"]})
+        db.execute(SQL_SET_DELETED, (0, ts, task_id))
+        log_event(db, "restore", task_id, {"title": task["title"], "due_date": task["due_date"]}, ts)
+        return True
+
+    if not run_write(op):
+        return redirect(url_for("index"))
 
     return redirect(url_for("index", show="deleted"))
 
@@ -298,55 +758,73 @@ def undo_last():
     - restore -> re-delete
     Then removes the event row.
     """
-    with get_db() as db:
-        ev = db.execute("SELECT * FROM events ORDER BY id DESC LIMIT 1").fetchone()
+    ts = g.now_ms
+
+    # The event lookup runs on the writer thread, inside the same transaction as the revert
+    def op(db: WriteConn) -> str:
+        ev = db.execute(SQL_LATEST_EVENT).fetchone()
         if ev is None:
-            flash("Nothing to undo yet.", "info")
-            return redirect(url_for("index"))
+            return "empty"
 
         action = ev["action"]
         task_id = ev["task_id"]
-        payload = json.loads(ev["payload_json"])
+        payload = decode_payload(ev)
 
         try:
             if action == "create":
-                db.execute("DELETE FROM tasks WHERE id=?", (task_id,))
+                db.execute(SQL_DELETE_TASK, (task_id,))
             elif action == "toggle":
                 before_done = int(payload["before_done"])
-                ts = now_iso()
-                db.execute("UPDATE tasks SET done=?, updated_at=? WHERE id=?", (before_done, ts, task_id))
+                db.execute(SQL_SET_DONE, (before_done, ts, task_id))
             elif action == "edit":
                 before_title = payload.get("before_title")
                 before_due = payload.get("before_due")
-                ts = now_iso()
-                db.execute(
-                    "UPDATE tasks SET title=?, due_date=?, updated_at=? WHERE id=?",
-                    (before_title, before_due, ts, task_id),
-                )
+                db.execute(SQL_SET_TITLE_DUE, (before_title, before_due, ts, task_id))
             elif action == "delete":
-                ts = now_iso()
-                db.execute("UPDATE tasks SET deleted=0, updated_at=? WHERE id=?", (ts, task_id))
+                db.execute(SQL_SET_DELETED, (0, ts, task_id))
             elif action == "restore":
-                ts = now_iso()
-                db.execute("UPDATE tasks SET deleted=1, updated_at=? WHERE id=?", (ts, task_id))
+                db.execute(SQL_SET_DELETED, (1, ts, task_id))
             else:
-                flash("Undo not supported for that action yet.", "error")
-                return redirect(url_for("index"))
+                return "unsupported"
         except Exception:
-            flash("Undo failed (task may have been removed).", "error")
-            return redirect(url_for("index"))
-
-        db.execute("DELETE FROM events WHERE id=?", (ev["id"],))
+            return "failed"
+
+        db.execute(SQL_DELETE_EVENT, (ev["id"],))
+        return "ok"
+
+    result = run_write(op)
+    if result == "empty":
+        flash("Nothing to undo yet.", "info")
+    elif result == "unsupported":
+        flash("Undo not supported for that action yet.", "error")
+    elif result == "failed":
+        flash("Undo failed (task may have been removed).", "error")
+    else:
         flash("Undid last action.", "success")
 
     return redirect(url_for("index"))
 
 
+# (newest event id, rows) for the activity feed. Events are only appended, or
+# lose their newest row to undo, and AUTOINCREMENT never reuses an id, so
+# MAX(id) pins down the exact feed. Checking it in SQL (not an in-process
+# counter) also picks up writes made by other processes.
+_activity_cache: Tuple[Optional[int], List[sqlite3.Row]] = (None, [])
+
+
 @app.get("/activity")
 @login_required
 def activity():
+    global _activity_cache
     with get_db() as db:
-        events = db.execute("SELECT * FROM events ORDER BY id DESC LIMIT 200").fetchall()
+        last_event_id = db.execute(SQL_LAST_EVENT_ID).fetchone()[0]
+        cached_id, events = _activity_cache
+        if last_event_id is None:
+            events = []
+        elif cached_id != last_event_id:
+            events = db.execute(SQL_RECENT_EVENTS).fetchall()
+            # Key on what was actually fetched; a write can land between the two statements
+            _activity_cache = (events[0]["id"] if events else None, events)
     return render_template("activity.html", events=events)
 
 